@@ -1,39 +1,121 @@
 # Copyright (C) 2022 Nikolas Koesling <nikolas@koesling.info>
 
-import matplotlib.pyplot as plt
+import concurrent.futures
+import functools
+import math
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+import numpy as np
 import os
+import stat
+import warnings
+
+# file extensions of vector image formats, the dpi setting is not used for these
+_VECTOR_FORMATS = {'.svg', '.pdf', '.ps', '.eps'}
+
+
+##
+# @brief check if a directory is writable
+#
+# @details
+# Results are cached. Call clear_writable_cache() if permissions change.
+#
+# @param d directory path as string
+#
+@functools.lru_cache(maxsize=128)
+def _dir_writable(d):
+    return os.access(d or '.', os.W_OK)
+# end def _dir_writable
+
+
+##
+# @brief clear the cached results of directory writability checks
+#
+def clear_writable_cache():
+    _dir_writable.cache_clear()
+# end def clear_writable_cache
 
 
 ##
 # @brief check if a file can be written
 #
+# @deprecated SimplePlot.create no longer checks the file in advance but reports errors while writing it.
+#
 # @param f filepath as string
 #
 def check_file_writable(f):
+    warnings.warn("check_file_writable is deprecated", DeprecationWarning, stacklevel=2)
+
     if not isinstance(f, str):
         raise RuntimeError(f"{type(f)} is not a valid filename type")
     # end if
 
-    if os.path.exists(f):
-        if os.path.isfile(f):
-            return os.access(f, os.W_OK)
+    try:
+        st = os.stat(f)
+    except FileNotFoundError:
+        return _dir_writable(os.path.dirname(f))
+    except OSError:
+        return False
+    # end try
+
+    return stat.S_ISREG(st.st_mode) and os.access(f, os.W_OK)
+# end def check_file_writable
+
+
+##
+# @brief determine minimum and maximum of an array
+#
+# @param a non-empty numpy array
+#
+# @return tuple (minimum, maximum)
+#
+def _minmax(a):
+    return a.min(), a.max()
+# end def _minmax
+
+
+##
+# @brief save a figure to a file
+#
+# @details
+# The dpi setting is not used for vector formats.
+#
+# @param fig figure to save
+# @param filename path of the file
+# @param dpi output dpi for raster formats
+#
+def _save_figure(fig, filename, dpi):
+    try:
+        if os.path.splitext(filename)[1].lower() in _VECTOR_FORMATS:
+            fig.savefig(filename)
         else:
-            return False
+            fig.savefig(filename, dpi=dpi)
         # end if
-    else:
-        parent = os.path.dirname(f)
-        if not parent:
-            parent = '.'
-        # end if
-        return os.access(parent, os.W_OK)
-    # end if
-# end def check_file_writable
+    except OSError as e:
+        raise RuntimeError(f"Cannot write {filename}: {e}")
+    # end try
+# end def _save_figure
 
 
 ##
 # @brief wrapper to create simple plots with pyplot
 #
 class SimplePlot:
+    __slots__ = ('__dpi', '__x_data', '__x_min', '__x_max', '__y_data', '__y_min', '__y_max', '__x_label',
+                 '__y_label', '__title', '__legend', '__y_limits', '__x_limits', '__log_x', '__log_y', '__grid',
+                 '__lines', '__collection', '__futures', '__fig_keys')
+
+    # figures used to save plots, shared by all instances: (dpi, figsize) -> (fig, ax)
+    _fig_cache = {}
+
+    # pending background save operations of the cached figures: (dpi, figsize) -> future
+    _pending = {}
+
+    # executor for background save operations, created on first use
+    _executor = None
+
     ##
     # @brief
     # initialize SimplePlot instance
@@ -43,14 +125,14 @@ class SimplePlot:
     #   - No axis labels
     #   - Y axis starting at 0, upper limit determined by the input data
     #   - X axis limit depending on the input data
-    #   - 1200 dpi when saving as image
+    #   - 300 dpi when saving as raster image
     #   - no grid
     #   - linear x and y axis
     #
     # @param title Plot title, default: no title
     #
     def __init__(self, title=None):
-        if title is not None:
+        if title is not None and not isinstance(title, str):
             try:
                 title = f"{title}"
             except Exception as e:
@@ -58,9 +140,13 @@ class SimplePlot:
             # end try
         # end if
 
-        self.__dpi = 1200
+        self.__dpi = 300
         self.__x_data = None
+        self.__x_min = math.inf
+        self.__x_max = -math.inf
         self.__y_data = []
+        self.__y_min = math.inf
+        self.__y_max = -math.inf
         self.__x_label = None
         self.__y_label = None
         self.__title = title
@@ -70,11 +156,19 @@ class SimplePlot:
         self.__log_x = False
         self.__log_y = False
         self.__grid = None
+        self.__lines = []
+        self.__collection = None
+        self.__futures = []
+        self.__fig_keys = set()
     # end def __init__
 
     ##
     # @brief set output dpi
     #
+    # @details
+    # Only applies to raster image formats. Vector formats (svg, pdf, ps, eps) are saved without a dpi setting.
+    # Default: 300 dpi
+    #
     # @param dpi DPI value to set (>0)
     #
     def set_dpi(self, dpi):
@@ -133,6 +227,7 @@ class SimplePlot:
     #
     # @details
     # set the value to None to let pyplot generate the limits based on the input data.
+    # A warning is issued if the limits exclude all values of the x data set.
     # Not allowed if logarithmic scale is enabled
     #
     # @param xmin lower limit
@@ -146,7 +241,13 @@ class SimplePlot:
             xmin = float(xmin)
         if xmax is not None:
             xmax = float(xmax)
-        self.__y_limits = (xmin, xmax)
+
+        if self.__x_data is not None and \
+                ((xmin is not None and xmin > self.__x_max) or (xmax is not None and xmax < self.__x_min)):
+            warnings.warn(f"X limits ({xmin}, {xmax}) exclude all values of the x data set", stacklevel=2)
+        # end if
+
+        self.__x_limits = (xmin, xmax)
     # end def set_x_limits
 
     ##
@@ -154,6 +255,7 @@ class SimplePlot:
     #
     # @details
     # set the value to None to let pyplot generate the limits based on the input data.
+    # A warning is issued if the limits exclude all values of the already added y data sets.
     # Not allowed if logarithmic scale is enabled
     #
     # @param ymin lower limit
@@ -167,6 +269,12 @@ class SimplePlot:
             ymin = float(ymin)
         if ymax is not None:
             ymax = float(ymax)
+
+        if len(self.__y_data) > 0 and \
+                ((ymin is not None and ymin > self.__y_max) or (ymax is not None and ymax < self.__y_min)):
+            warnings.warn(f"Y limits ({ymin}, {ymax}) exclude all values of the y data sets", stacklevel=2)
+        # end if
+
         self.__y_limits = (ymin, ymax)
     # end def set_y_limits
 
@@ -174,6 +282,135 @@ class SimplePlot:
         pass
     # end def save
 
+    ##
+    # @brief release the cached figures used by this instance to save plots
+    #
+    # @details
+    # Includes figures cached for previous dpi and figure size settings.
+    #
+    def close(self):
+        for key in self.__fig_keys:
+            SimplePlot._fig_cache.pop(key, None)
+        # end for
+        self.__fig_keys = set()
+    # end def close
+
+    ##
+    # @brief key of the cached figure for the current settings
+    #
+    def __fig_key(self):
+        return self.__dpi, tuple(matplotlib.rcParams['figure.figsize'])
+    # end def __fig_key
+
+    ##
+    # @brief get a figure from the cache, create a new one if there is none
+    #
+    # @details
+    # The figure is rendered by the Agg canvas directly and is not managed by pyplot.
+    # Waits for a pending background save of the figure.
+    #
+    def __get_figure(self):
+        key = self.__fig_key()
+
+        # the figure must not be modified until a pending background save is finished
+        pending = SimplePlot._pending.pop(key, None)
+        if pending is not None:
+            concurrent.futures.wait((pending,))
+        # end if
+
+        self.__fig_keys.add(key)
+        entry = SimplePlot._fig_cache.get(key)
+        if entry is None:
+            fig = Figure()
+            FigureCanvasAgg(fig)
+            entry = (fig, fig.subplots())
+            SimplePlot._fig_cache[key] = entry
+        # end if
+        return entry
+    # end def __get_figure
+
+    ##
+    # @brief draw the data sets on the axes
+    #
+    # @details
+    # If a legend is required, every data set is drawn as separate line. Otherwise, all data sets are drawn as a single
+    # line collection.
+    # The artists drawn by the previous call are updated in place if they are still part of the axes and the number of
+    # data sets did not change. Otherwise, the axes is cleared and new artists are created.
+    #
+    # @param ax axes to draw on
+    # @param labels one label per data set
+    # @param use_legend draw separate lines that can be referenced by a legend
+    #
+    def __draw_lines(self, ax, labels, use_legend):
+        if use_legend:
+            reuse = len(self.__lines) > 0 and len(self.__lines) == len(self.__y_data) and \
+                    all(line.axes is ax for line in self.__lines)
+        else:
+            reuse = self.__collection is not None and self.__collection.axes is ax and \
+                    len(self.__collection.get_segments()) == len(self.__y_data)
+        # end if
+
+        if not reuse:
+            ax.clear()
+            self.__lines = []
+            self.__collection = None
+
+            if use_legend:
+                for i in range(len(self.__y_data)):
+                    l, = ax.plot(self.__x_data, self.__y_data[i], label=labels[i])
+                    self.__lines.append(l)
+                # end for
+            else:
+                colors = matplotlib.rcParams['axes.prop_cycle'].by_key().get('color', ['C0'])
+                self.__collection = LineCollection(self.__segments(),
+                                                   colors=[colors[i % len(colors)] for i in range(len(self.__y_data))],
+                                                   linewidths=matplotlib.rcParams['lines.linewidth'],
+                                                   capstyle=matplotlib.rcParams['lines.solid_capstyle'],
+                                                   joinstyle=matplotlib.rcParams['lines.solid_joinstyle'])
+                ax.add_collection(self.__collection)
+                ax.autoscale_view()
+            # end if
+            return
+        # end if
+
+        # undo the settings applied by the previous call
+        legend = ax.get_legend()
+        if legend is not None:
+            legend.remove()
+        # end if
+        ax.set_xscale('linear')
+        ax.set_yscale('linear')
+        ax.set_xlabel('')
+        ax.set_ylabel('')
+        ax.set_title('')
+        ax.grid(False)
+        ax.set_autoscale_on(True)
+
+        if use_legend:
+            for line, y_data, label in zip(self.__lines, self.__y_data, labels):
+                line.set_data(self.__x_data, y_data)
+                line.set_label(label)
+            # end for
+            ax.relim()
+        else:
+            self.__collection.set_segments(self.__segments())
+            # re-add the collection to update the data limits
+            self.__collection.remove()
+            ax.relim()
+            ax.add_collection(self.__collection)
+        # end if
+
+        ax.autoscale_view()
+    # end def __draw_lines
+
+    ##
+    # @brief line segments of all y data sets as (x, y) arrays
+    #
+    def __segments(self):
+        return [np.column_stack((self.__x_data, y_data)) for y_data in self.__y_data]
+    # end def __segments
+
     ##
     # @brief set the x-axis values
     #
@@ -185,8 +422,17 @@ class SimplePlot:
     # @param x_data the new x data set
     #
     def set_x_data(self, x_data):
-        if type(x_data) is not list and type(x_data) is not tuple:
-            raise RuntimeError(f"x_data is neither list nor tuple, but {type(x_data)}")
+        if type(x_data) is not list and type(x_data) is not tuple and type(x_data) is not np.ndarray:
+            raise RuntimeError(f"x_data is neither list, tuple nor ndarray, but {type(x_data)}")
+
+        try:
+            x_data = np.ascontiguousarray(x_data, dtype=np.float64)
+        except (TypeError, ValueError) as e:
+            raise RuntimeError(f"Unable to convert x_data to float array: {e}")
+        # end try
+
+        if x_data.ndim != 1:
+            raise RuntimeError(f"x_data must be one-dimensional, but has {x_data.ndim} dimensions")
 
         if len(x_data) <= 0:
             raise RuntimeError(f"x_data is empty")
@@ -196,17 +442,17 @@ class SimplePlot:
                 raise RuntimeError(f"Each y data set must be of the same length as the x data set: "
                                   f"{len(self.__y_data[0])} != {len(x_data)}")
 
-        if self.__x_limits[0] is not None:
-            m = min(x_data)
-            if m < self.__x_limits[0]:
-                self.__x_limits = (None, self.__x_limits[1])
+        lo, hi = _minmax(x_data)
+
+        if self.__x_limits[0] is not None and lo < self.__x_limits[0]:
+            self.__x_limits = (None, self.__x_limits[1])
 
-        if self.__x_limits[1] is not None:
-            m = max(x_data)
-            if m > self.__x_limits[0]:
-                self.__x_limits = (self.__x_limits[0], None)
+        if self.__x_limits[1] is not None and hi > self.__x_limits[1]:
+            self.__x_limits = (self.__x_limits[0], None)
 
         self.__x_data = x_data
+        self.__x_min = lo
+        self.__x_max = hi
     # end def set_x_data
 
     ##
@@ -218,8 +464,20 @@ class SimplePlot:
     # #param y_data the y data set to add
     #
     def add_y_data(self, y_data, label=None):
-        if type(y_data) is not list and type(y_data) is not tuple:
-            raise RuntimeError(f"y_data entry is neither list nor tuple, but {type(y_data)}")
+        if type(y_data) is not list and type(y_data) is not tuple and type(y_data) is not np.ndarray:
+            raise RuntimeError(f"y_data entry is neither list, tuple nor ndarray, but {type(y_data)}")
+
+        try:
+            y_data = np.ascontiguousarray(y_data, dtype=np.float64)
+        except (TypeError, ValueError) as e:
+            raise RuntimeError(f"Unable to convert y_data to float array: {e}")
+        # end try
+
+        if y_data.ndim != 1:
+            raise RuntimeError(f"y_data must be one-dimensional, but has {y_data.ndim} dimensions")
+
+        if len(y_data) <= 0:
+            raise RuntimeError(f"y_data is empty")
 
         if self.__x_data is not None:
             if len(y_data) != len(self.__x_data):
@@ -229,23 +487,36 @@ class SimplePlot:
             if len(y_data) != len(self.__y_data[0]):
                 raise RuntimeError(f"All y data sets must have the same length: {len(y_data)} != {len(self.__y_data[0])}")
 
-        if label is not None:
+        if label is not None and not isinstance(label, str):
             label = f"{label}"
 
-        if self.__y_limits[0] is not None:
-            m = min(y_data)
-            if m < self.__y_limits[0]:
-                self.__y_limits = (None, self.__y_limits[1])
+        lo, hi = _minmax(y_data)
+        self.__y_min = min(self.__y_min, lo)
+        self.__y_max = max(self.__y_max, hi)
+
+        if self.__y_limits[0] is not None and lo < self.__y_limits[0]:
+            self.__y_limits = (None, self.__y_limits[1])
 
-        if self.__y_limits[1] is not None:
-            m = max(y_data)
-            if m > self.__y_limits[0]:
-                self.__y_limits = (self.__y_limits[0], None)
+        if self.__y_limits[1] is not None and hi > self.__y_limits[1]:
+            self.__y_limits = (self.__y_limits[0], None)
 
         self.__legend.append(label)
         self.__y_data.append(y_data)
     # end def add_y_data
 
+    ##
+    # @brief removes all y data sets and their labels
+    #
+    # @details
+    # Y limits that were removed because of the cleared data sets are not restored. Use set_y_limits to set them again.
+    #
+    def clear_y_data(self):
+        self.__y_data = []
+        self.__legend = []
+        self.__y_min = math.inf
+        self.__y_max = -math.inf
+    # end def clear_y_data
+
     ##
     # @brief adds multiple new y data sets
     #
@@ -293,10 +564,16 @@ class SimplePlot:
     #
     # @details
     # The plot is either saved as an image file or displayed.
+    # Figures used to save plots are cached and reused by subsequent calls. Use close() to release them.
+    # If background is set, the file is written by a worker thread. Errors are reported by the returned future and by
+    # wait(). Failed operations are kept until wait() is called.
     #
     # @param filename path of the file to save the plot. The plot will be displayed if set to None
+    # @param background save the plot in a background thread
+    #
+    # @return future of the background save operation, None otherwise
     #
-    def create(self, filename=None):
+    def create(self, filename=None, background=False):
         if self.__x_data is None:
             raise RuntimeError("No x data set")
         # end if
@@ -305,27 +582,23 @@ class SimplePlot:
             raise RuntimeError("No y data set")
         # end if
 
-        if filename is not None and not check_file_writable(filename):
-            raise RuntimeError(f"File '{filename}' can't be created/written")
+        labels = self.__legend
+        use_legend = any(elem is not None for elem in labels)
+        if use_legend:
+            labels = [label or '' for label in labels]
         # end if
 
-        use_legend = any(elem is not None for elem in self.__legend)
-        for i in range(len(self.__legend)):
-            if self.__legend[i] is None:
-                self.__legend[i] = ''
-            # end if
-        # end for
+        if filename is not None:
+            fig, ax = self.__get_figure()
+        else:
+            import matplotlib.pyplot as plt
+            fig, ax = plt.subplots()
+        # end if
 
-        lines = []
-        fig, ax = plt.subplots()
-
-        for i in range(len(self.__y_data)):
-            l, = ax.plot(self.__x_data, self.__y_data[i], label=self.__legend[i])
-            lines.append(l)
-        # end for
+        self.__draw_lines(ax, labels, use_legend)
 
         if use_legend:
-            ax.legend(handles=lines)
+            ax.legend(handles=self.__lines)
         # end if
 
         if not self.__log_x:
@@ -356,11 +629,43 @@ class SimplePlot:
             ax.grid(color=self.__grid[0], linestyle=self.__grid[1])
         # end if
 
-        if filename is not None:
-            plt.savefig(filename, dpi=self.__dpi)
-        else:
+        if filename is None:
             plt.show()
+        elif background:
+            future = SimplePlot.__get_executor().submit(_save_figure, fig, filename, self.__dpi)
+            SimplePlot._pending[self.__fig_key()] = future
+            # keep only pending and failed operations, so that errors are still reported by wait()
+            self.__futures = [f for f in self.__futures if not f.done() or f.exception() is not None]
+            self.__futures.append(future)
+            return future
+        else:
+            _save_figure(fig, filename, self.__dpi)
         # end if
     # end def create
 
+    ##
+    # @brief wait until all plots saved in the background by this instance are written
+    #
+    # @details
+    # Raises the first error that occurred while saving.
+    #
+    def wait(self):
+        futures = self.__futures
+        self.__futures = []
+        for future in futures:
+            future.result()
+        # end for
+    # end def wait
+
+    ##
+    # @brief get the executor used to save plots in the background, create it if there is none
+    #
+    @staticmethod
+    def __get_executor():
+        if SimplePlot._executor is None:
+            SimplePlot._executor = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+        # end if
+        return SimplePlot._executor
+    # end def __get_executor
+
 # end class SimplePlot